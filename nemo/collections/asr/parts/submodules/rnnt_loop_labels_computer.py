@@ -325,6 +325,9 @@ class GreedyBatchedRNNTLoopLabelsComputer(WithOptionalCudaGraphs, ConfidenceMeth
             batch_size=batch_size,
             logits_dim=self.joint.num_classes_with_blank,
             init_length=max_time * 2 if use_alignments else 1,  # blank for each timestep + text tokens
+            max_length_hint=(
+                max_time * (self.max_symbols + 1) if use_alignments and self.max_symbols is not None else None
+            ),
             device=device,
             float_dtype=float_dtype,
             store_alignments=self.preserve_alignments,
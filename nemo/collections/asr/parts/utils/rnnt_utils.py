@@ -26,6 +26,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import itertools
 from dataclasses import dataclass, field
 from typing import Any, Dict, List, Optional, Tuple, Union
 
@@ -116,6 +117,9 @@ class Hypothesis:
         # self.timestep can be a dict for RNNT
         timestep = self.timestep['timestep'] if isinstance(self.timestep, dict) else self.timestep
         if len(timestep) != 0 and self.frame_confidence is not None:
+            # convert once to avoid repeated (possibly device) tensor indexing
+            if isinstance(timestep, torch.Tensor):
+                timestep = timestep.tolist()
             if any(isinstance(i, list) for i in self.frame_confidence):  # rnnt
                 t_prev = -1
                 offset = 0
@@ -160,7 +164,7 @@ class HATJointOutput:
     ilm_logprobs: Optional[torch.Tensor] = None
 
 
-def is_prefix(x: List[int], pref: List[int]) -> bool:
+def is_prefix(x: Union[List[int], torch.Tensor], pref: Union[List[int], torch.Tensor]) -> bool:
     """
     Obtained from https://github.com/espnet/espnet.
 
@@ -176,11 +180,16 @@ def is_prefix(x: List[int], pref: List[int]) -> bool:
     if len(pref) >= len(x):
         return False
 
-    for i in range(len(pref)):
-        if pref[i] != x[i]:
-            return False
+    if isinstance(x, torch.Tensor) and isinstance(pref, torch.Tensor):
+        return torch.equal(x[: len(pref)], pref)
 
-    return True
+    # compare lists at once instead of element-wise Python loop
+    x_prefix = x[: len(pref)]
+    if isinstance(x_prefix, torch.Tensor):
+        x_prefix = x_prefix.tolist()
+    if isinstance(pref, torch.Tensor):
+        pref = pref.tolist()
+    return list(x_prefix) == list(pref)
 
 
 def select_k_expansions(
@@ -205,21 +214,120 @@ def select_k_expansions(
     """
     k_expansions = []
 
-    for i, hyp in enumerate(hyps):
-        hyp_i = [(int(k), hyp.score + float(v)) for k, v in zip(topk_idxs[i], topk_logps[i])]
-        k_best_exp_val = max(hyp_i, key=lambda x: x[1])
+    # move inputs to cpu once: results are needed on host, and float64 is not supported on all devices (e.g., mps)
+    topk_idxs = topk_idxs.cpu()
+    topk_logps = topk_logps.cpu()
+    # compute scores for all expansions at once; use float64 to match Python float arithmetic
+    hyp_scores = torch.tensor([hyp.score for hyp in hyps], dtype=torch.float64)
+    all_scores = hyp_scores.unsqueeze(1) + topk_logps.to(torch.float64)  # [B, num_candidates]
+    best_scores, best_positions = all_scores.max(dim=-1)
+    keep_mask = all_scores >= (best_scores - gamma).unsqueeze(1)
+    # sort all rows at once (stable, as Python `sorted`), pruned expansions are moved to the end
+    sorted_scores, sorted_positions = torch.sort(
+        torch.where(keep_mask, all_scores, torch.full_like(all_scores, float("inf"))), dim=-1, stable=True
+    )
+    sorted_idxs = topk_idxs.gather(1, sorted_positions)
+    best_idxs = topk_idxs.gather(1, best_positions.unsqueeze(1)).squeeze(1)
+
+    # convert to Python lists only once (cpu tensors, no device-to-host synchronization)
+    num_kept = keep_mask.sum(dim=-1).tolist()
+    sorted_scores = sorted_scores.tolist()
+    sorted_idxs = sorted_idxs.tolist()
+    best_scores = best_scores.tolist()
+    best_idxs = best_idxs.tolist()
+
+    for i in range(len(hyps)):
+        if num_kept[i] > 0:
+            k_expansions.append(list(zip(sorted_idxs[i][: num_kept[i]], sorted_scores[i][: num_kept[i]])))
+        else:
+            k_expansions.append([(best_idxs[i], best_scores[i])])
 
-        k_best_exp_idx = k_best_exp_val[0]
-        k_best_exp = k_best_exp_val[1]
+    return k_expansions
 
-        expansions = sorted(filter(lambda x: (k_best_exp - gamma) <= x[1], hyp_i), key=lambda x: x[1],)
 
-        if len(expansions) > 0:
-            k_expansions.append(expansions)
-        else:
-            k_expansions.append([(k_best_exp_idx, k_best_exp)])
+def _get_increased_length(length: int, max_length_hint: Optional[int]) -> int:
+    """
+    Get new length for the storage: 2x of the current length, similar to common C++ std::vector implementations
+    to maintain O(1) insertion time complexity, but not larger than max_length_hint (if it is not reached yet).
+    Storage is increased only when the actual length requires it, so with a correct upper bound as a hint
+    storage never grows beyond it; doubling after reaching the hint is used only if the hint is not an upper bound.
 
-    return k_expansions
+    Args:
+        length: current length of the storage
+        max_length_hint: optional upper bound for the maximum length
+
+    Returns:
+        new length
+    """
+    new_length = length * 2
+    if max_length_hint is not None and length < max_length_hint and max_length_hint < new_length:
+        new_length = max_length_hint
+    return new_length
+
+
+def _extend_time_dim(tensor: torch.Tensor, new_length: int) -> torch.Tensor:
+    """
+    Allocate a tensor with the new size along the time (2nd) dimension and copy the original data to its beginning.
+    The rest is not initialized.
+
+    Args:
+        tensor: tensor of shape [B, T, ...]
+        new_length: new size along the time dimension, should be >= T
+
+    Returns:
+        tensor of shape [B, new_length, ...]
+    """
+    shape = list(tensor.shape)
+    length = shape[1]
+    shape[1] = new_length
+    new_tensor = torch.empty(shape, device=tensor.device, dtype=tensor.dtype)
+    new_tensor[:, :length].copy_(tensor)
+    return new_tensor
+
+
+@torch.jit.script
+def _add_results_by_indices_(
+    active_indices: torch.Tensor,
+    labels: torch.Tensor,
+    time_indices: torch.Tensor,
+    scores: torch.Tensor,
+    hyps_scores: torch.Tensor,
+    transcript: torch.Tensor,
+    timesteps: torch.Tensor,
+    last_timestep: torch.Tensor,
+    last_timestep_lasts: torch.Tensor,
+    current_lengths: torch.Tensor,
+):
+    """
+    Add results (inplace) from a decoding step to the storage of BatchedHyps.
+    Kept as a separate scripted function to reduce the overhead from launching multiple small kernels.
+
+    Args:
+        active_indices: tensor with indices of active hypotheses (indices should be within the original batch_size)
+        labels: non-blank labels to add
+        time_indices: tensor of time index for each label
+        scores: label scores
+        hyps_scores, transcript, timesteps, last_timestep, last_timestep_lasts, current_lengths:
+            BatchedHyps storage tensors, modified inplace
+    """
+    # index_copy_ requires long indices
+    active_indices = active_indices.long()
+    # accumulate scores
+    hyps_scores.index_add_(0, active_indices, scores.to(hyps_scores.dtype))
+
+    # store transcript and timesteps
+    # positions are computed once and used for both tensors, index_put_ avoids materializing linear indices
+    active_lengths = current_lengths[active_indices]
+    transcript.index_put_((active_indices, active_lengths), labels.to(transcript.dtype))
+    timesteps.index_put_((active_indices, active_lengths), time_indices.to(timesteps.dtype))
+    # store last observed timestep + number of observation for the current timestep
+    # branchless: if last_timestep == time_indices, increase; else set to 1
+    prev_lasts = last_timestep_lasts[active_indices]
+    same_timestep = (last_timestep[active_indices] == time_indices).to(prev_lasts.dtype)
+    last_timestep_lasts.index_copy_(0, active_indices, prev_lasts * same_timestep + 1)
+    last_timestep.index_copy_(0, active_indices, time_indices.to(last_timestep.dtype))
+    # increase lengths
+    current_lengths.index_add_(0, active_indices, torch.ones_like(active_indices))
 
 
 class BatchedHyps:
@@ -231,6 +339,7 @@ class BatchedHyps:
         init_length: int,
         device: Optional[torch.device] = None,
         float_dtype: Optional[torch.dtype] = None,
+        max_length_hint: Optional[int] = None,
     ):
         """
 
@@ -238,22 +347,33 @@ class BatchedHyps:
             batch_size: batch size for hypotheses
             init_length: initial estimate for the length of hypotheses (if the real length is higher, tensors will be reallocated)
             device: device for storing hypotheses
-            float_dtype: float type for scores
+            float_dtype: float type for scores, torch.float32 if not set;
+                lower precision types (e.g., torch.bfloat16) reduce the memory footprint, but accumulated scores
+                for long utterances are less precise (labels are not affected)
+            max_length_hint: optional upper bound for the length of hypotheses (e.g., max_time * max_symbols);
+                if known, storage is increased up to this length instead of doubling, and never beyond it
+                (if the bound is not correct and the actual length reaches it, doubling is used)
         """
         if init_length <= 0:
             raise ValueError(f"init_length must be > 0, got {init_length}")
         if batch_size <= 0:
             raise ValueError(f"batch_size must be > 0, got {batch_size}")
         self._max_length = init_length
+        self._max_length_hint = max_length_hint
+        # upper bound for current_lengths.max(), tracked on host to avoid device-to-host synchronization;
+        # the bound is loose (all calls are counted), exact value is computed only when storage seems to be full
+        self._current_max_length = 0
 
         # batch of current lengths of hypotheses and correspoinding timesteps
         self.current_lengths = torch.zeros(batch_size, device=device, dtype=torch.long)
-        # tensor for storing transcripts
-        self.transcript = torch.zeros((batch_size, self._max_length), device=device, dtype=torch.long)
+        # tensor for storing transcripts; int32 is enough for labels and timesteps, and halves memory traffic
+        self.transcript = torch.zeros((batch_size, self._max_length), device=device, dtype=torch.int32)
         # tensor for storing timesteps corresponding to transcripts
-        self.timesteps = torch.zeros((batch_size, self._max_length), device=device, dtype=torch.long)
+        self.timesteps = torch.zeros((batch_size, self._max_length), device=device, dtype=torch.int32)
         # accumulated scores for hypotheses
-        self.scores = torch.zeros(batch_size, device=device, dtype=float_dtype)
+        self.scores = torch.zeros(
+            batch_size, device=device, dtype=float_dtype if float_dtype is not None else torch.float32
+        )
 
         # tracking last timestep of each hyp to avoid infinite looping (when max symbols per frame is restricted)
         # last observed timestep (with label) for each hypothesis
@@ -261,24 +381,40 @@ class BatchedHyps:
         # number of labels for the last timestep
         self.last_timestep_lasts = torch.zeros(batch_size, device=device, dtype=torch.long)
         self._batch_indices = torch.arange(batch_size, device=device)
-        self._ones_batch = torch.ones_like(self._batch_indices)
 
     def clear_(self):
+        """
+        Clear hypotheses (inplace) to reuse the allocated storage, e.g., for the next batch of utterances.
+        Transcript and timesteps are not cleared: data beyond current lengths is stale, but never read
+        """
         self.current_lengths.fill_(0)
-        self.transcript.fill_(0)
-        self.timesteps.fill_(0)
+        self._current_max_length = 0
         self.scores.fill_(0.0)
         self.last_timestep.fill_(-1)
         self.last_timestep_lasts.fill_(0)
 
     def _allocate_more(self):
         """
-        Allocate 2x space for tensors, similar to common C++ std::vector implementations
-        to maintain O(1) insertion time complexity
+        Allocate 2x space for tensors (or up to max_length_hint), similar to common C++ std::vector implementations
+        to maintain O(1) insertion time complexity.
+        New elements are not initialized: data beyond current lengths is always written before being read
+        """
+        new_length = _get_increased_length(self._max_length, self._max_length_hint)
+        self.transcript = _extend_time_dim(self.transcript, new_length)
+        self.timesteps = _extend_time_dim(self.timesteps, new_length)
+        self._max_length = new_length
+
+    def _allocate_more_if_needed(self):
+        """
+        Increase storage if the next results may not fit.
+        The host-side bound counts add calls, not the actual lengths (e.g., masked calls with sparse masks),
+        so when the bound reaches the storage length, the exact max length is computed
+        (device-to-host synchronization, but only on this rare path), and storage is increased only if needed
         """
-        self.transcript = torch.cat((self.transcript, torch.zeros_like(self.transcript)), dim=-1)
-        self.timesteps = torch.cat((self.timesteps, torch.zeros_like(self.timesteps)), dim=-1)
-        self._max_length *= 2
+        if self._current_max_length >= self._max_length:
+            self._current_max_length = int(self.current_lengths.max().item())
+            if self._current_max_length >= self._max_length:
+                self._allocate_more()
 
     def add_results_(
         self, active_indices: torch.Tensor, labels: torch.Tensor, time_indices: torch.Tensor, scores: torch.Tensor
@@ -295,8 +431,7 @@ class BatchedHyps:
         if active_indices.shape[0] == 0:
             return  # nothing to add
         # if needed - increase storage
-        if self.current_lengths.max().item() >= self._max_length:
-            self._allocate_more()
+        self._allocate_more_if_needed()
 
         self.add_results_no_checks_(
             active_indices=active_indices, labels=labels, time_indices=time_indices, scores=scores
@@ -316,20 +451,19 @@ class BatchedHyps:
             time_indices: tensor of time index for each label
             scores: label scores
         """
-        # accumulate scores
-        self.scores[active_indices] += scores
-
-        # store transcript and timesteps
-        active_lengths = self.current_lengths[active_indices]
-        self.transcript[active_indices, active_lengths] = labels
-        self.timesteps[active_indices, active_lengths] = time_indices
-        # store last observed timestep + number of observation for the current timestep
-        self.last_timestep_lasts[active_indices] = torch.where(
-            self.last_timestep[active_indices] == time_indices, self.last_timestep_lasts[active_indices] + 1, 1
+        _add_results_by_indices_(
+            active_indices=active_indices,
+            labels=labels,
+            time_indices=time_indices,
+            scores=scores,
+            hyps_scores=self.scores,
+            transcript=self.transcript,
+            timesteps=self.timesteps,
+            last_timestep=self.last_timestep,
+            last_timestep_lasts=self.last_timestep_lasts,
+            current_lengths=self.current_lengths,
         )
-        self.last_timestep[active_indices] = time_indices
-        # increase lengths
-        self.current_lengths[active_indices] += 1
+        self._current_max_length += 1
 
     def add_results_masked_(
         self, active_mask: torch.Tensor, labels: torch.Tensor, time_indices: torch.Tensor, scores: torch.Tensor
@@ -343,8 +477,7 @@ class BatchedHyps:
             time_indices: tensor of time index for each label
             scores: label scores
         """
-        if (self.current_lengths + active_mask).max() >= self._max_length:
-            self._allocate_more()
+        self._allocate_more_if_needed()
         self.add_results_masked_no_checks_(
             active_mask=active_mask, labels=labels, time_indices=time_indices, scores=scores
         )
@@ -363,31 +496,72 @@ class BatchedHyps:
             time_indices: tensor of time index for each label
             scores: label scores
         """
+        # bind attributes to locals once, all the tensors are modified inplace
+        hyps_scores = self.scores
+        current_lengths = self.current_lengths
+        last_timestep = self.last_timestep
+        last_timestep_lasts = self.last_timestep_lasts
+        batch_indices = self._batch_indices
+
         # accumulate scores
         # same as self.scores[active_mask] += scores[active_mask], but non-blocking
-        torch.where(active_mask, self.scores + scores, self.scores, out=self.scores)
+        torch.where(active_mask, hyps_scores + scores.to(hyps_scores.dtype), hyps_scores, out=hyps_scores)
 
         # store transcript and timesteps
-        self.transcript[self._batch_indices, self.current_lengths] = labels
-        self.timesteps[self._batch_indices, self.current_lengths] = time_indices
+        self.transcript[batch_indices, current_lengths] = labels.to(self.transcript.dtype)
+        self.timesteps[batch_indices, current_lengths] = time_indices.to(self.timesteps.dtype)
         # store last observed timestep + number of observation for the current timestep
-        # if last_timestep == time_indices, increase; else set to 1
-        torch.where(
-            torch.logical_and(active_mask, self.last_timestep == time_indices),
-            self.last_timestep_lasts + 1,
-            self.last_timestep_lasts,
-            out=self.last_timestep_lasts,
-        )
-        torch.where(
-            torch.logical_and(active_mask, self.last_timestep != time_indices),
-            self._ones_batch,
-            self.last_timestep_lasts,
-            out=self.last_timestep_lasts,
-        )
+        # if last_timestep == time_indices, increase; else set to 1; keep inactive unchanged
+        # branchless: lasts * (same_timestep or inactive) + active
+        last_timestep_lasts.mul_(torch.logical_or(last_timestep == time_indices, ~active_mask))
+        last_timestep_lasts.add_(active_mask)
         # same as: self.last_timestep[active_mask] = time_indices[active_mask], but non-blocking
-        torch.where(active_mask, time_indices, self.last_timestep, out=self.last_timestep)
+        torch.where(active_mask, time_indices, last_timestep, out=last_timestep)
         # increase lengths
-        self.current_lengths += active_mask
+        current_lengths.add_(active_mask)
+        self._current_max_length += 1
+
+    def add_results_all_active_(self, labels: torch.Tensor, time_indices: torch.Tensor, scores: torch.Tensor):
+        """
+        Add results (inplace) from a decoding step to the batched hypotheses, assuming all hypotheses are active.
+        We assume that all tensors have the same first dimension (batch_size), and labels are non-blanks.
+        Args:
+            labels: non-blank labels to add
+            time_indices: tensor of time index for each label
+            scores: label scores
+        """
+        self._allocate_more_if_needed()
+        self.add_results_all_active_no_checks_(labels=labels, time_indices=time_indices, scores=scores)
+
+    def add_results_all_active_no_checks_(
+        self, labels: torch.Tensor, time_indices: torch.Tensor, scores: torch.Tensor
+    ):
+        """
+        Add results (inplace) from a decoding step to the batched hypotheses without checks,
+        assuming all hypotheses are active. Uses only elementwise operations without gathering active hypotheses.
+        We assume that all tensors have the same first dimension (batch_size), and labels are non-blanks.
+        Useful if all the memory is pre-allocated, especially with cuda graphs
+        (otherwise prefer a more safe `add_results_all_active_`)
+        Args:
+            labels: non-blank labels to add
+            time_indices: tensor of time index for each label
+            scores: label scores
+        """
+        current_lengths = self.current_lengths
+        last_timestep_lasts = self.last_timestep_lasts
+        # accumulate scores
+        self.scores.add_(scores)
+
+        # store transcript and timesteps
+        self.transcript[self._batch_indices, current_lengths] = labels.to(self.transcript.dtype)
+        self.timesteps[self._batch_indices, current_lengths] = time_indices.to(self.timesteps.dtype)
+        # store last observed timestep + number of observation for the current timestep
+        # branchless: if last_timestep == time_indices, increase; else set to 1
+        last_timestep_lasts.mul_(self.last_timestep == time_indices).add_(1)
+        self.last_timestep.copy_(time_indices)
+        # increase lengths
+        current_lengths.add_(1)
+        self._current_max_length += 1
 
 
 class BatchedAlignments:
@@ -406,6 +580,7 @@ class BatchedAlignments:
         store_alignments: bool = True,
         store_frame_confidence: bool = False,
         with_duration_confidence: bool = False,
+        max_length_hint: Optional[int] = None,
     ):
         """
 
@@ -417,6 +592,10 @@ class BatchedAlignments:
             float_dtype: expected logits/confidence data type
             store_alignments: if alignments should be stored
             store_frame_confidence: if frame confidence should be stored
+            max_length_hint: optional upper bound for the length of flatten alignments
+                (e.g., max_time * (max_symbols + 1)); if known, storage is increased up to this length
+                instead of doubling, and never beyond it
+                (if the bound is not correct and the actual length reaches it, doubling is used)
         """
         if init_length <= 0:
             raise ValueError(f"init_length must be > 0, got {init_length}")
@@ -426,19 +605,23 @@ class BatchedAlignments:
         self.with_duration_confidence = with_duration_confidence
         self.with_alignments = store_alignments
         self._max_length = init_length
+        self._max_length_hint = max_length_hint
+        # upper bound for current_lengths.max(), tracked on host to avoid device-to-host synchronization;
+        # the bound is loose (all calls are counted), exact value is computed only when storage seems to be full
+        self._current_max_length = 0
 
         # tensor to store observed timesteps (for alignments / confidence scores)
-        self.timesteps = torch.zeros((batch_size, self._max_length), device=device, dtype=torch.long)
+        self.timesteps = torch.zeros((batch_size, self._max_length), device=device, dtype=torch.int32)
         # current lengths of the utterances (alignments)
         self.current_lengths = torch.zeros(batch_size, device=device, dtype=torch.long)
 
         # empty tensors instead of None to make torch.jit.script happy
         self.logits = torch.zeros(0, device=device, dtype=float_dtype)
-        self.labels = torch.zeros(0, device=device, dtype=torch.long)
+        self.labels = torch.zeros(0, device=device, dtype=torch.int32)
         if self.with_alignments:
             # logits and labels; labels can contain <blank>, different from BatchedHyps
             self.logits = torch.zeros((batch_size, self._max_length, logits_dim), device=device, dtype=float_dtype)
-            self.labels = torch.zeros((batch_size, self._max_length), device=device, dtype=torch.long)
+            self.labels = torch.zeros((batch_size, self._max_length), device=device, dtype=torch.int32)
 
         # empty tensor instead of None to make torch.jit.script happy
         self.frame_confidence = torch.zeros(0, device=device, dtype=float_dtype)
@@ -452,24 +635,40 @@ class BatchedAlignments:
         self._batch_indices = torch.arange(batch_size, device=device)
 
     def clear_(self):
+        """
+        Clear alignments (inplace) to reuse the allocated storage, e.g., for the next batch of utterances.
+        Timesteps, logits, labels and frame confidence are not cleared: data beyond current lengths is stale,
+        but never read
+        """
         self.current_lengths.fill_(0)
-        self.timesteps.fill_(0)
-        self.logits.fill_(0.0)
-        self.labels.fill_(0)
-        self.frame_confidence.fill_(0)
+        self._current_max_length = 0
 
     def _allocate_more(self):
         """
-        Allocate 2x space for tensors, similar to common C++ std::vector implementations
-        to maintain O(1) insertion time complexity
+        Allocate 2x space for tensors (or up to max_length_hint), similar to common C++ std::vector implementations
+        to maintain O(1) insertion time complexity.
+        New elements are not initialized: data beyond current lengths is always written before being read
         """
-        self.timesteps = torch.cat((self.timesteps, torch.zeros_like(self.timesteps)), dim=-1)
+        new_length = _get_increased_length(self._max_length, self._max_length_hint)
+        self.timesteps = _extend_time_dim(self.timesteps, new_length)
         if self.with_alignments:
-            self.logits = torch.cat((self.logits, torch.zeros_like(self.logits)), dim=1)
-            self.labels = torch.cat((self.labels, torch.zeros_like(self.labels)), dim=-1)
+            self.logits = _extend_time_dim(self.logits, new_length)
+            self.labels = _extend_time_dim(self.labels, new_length)
         if self.with_frame_confidence:
-            self.frame_confidence = torch.cat((self.frame_confidence, torch.zeros_like(self.frame_confidence)), dim=1)
-        self._max_length *= 2
+            self.frame_confidence = _extend_time_dim(self.frame_confidence, new_length)
+        self._max_length = new_length
+
+    def _allocate_more_if_needed(self):
+        """
+        Increase storage if the next results may not fit.
+        The host-side bound counts add calls, not the actual lengths (e.g., masked calls with sparse masks),
+        so when the bound reaches the storage length, the exact max length is computed
+        (device-to-host synchronization, but only on this rare path), and storage is increased only if needed
+        """
+        if self._current_max_length >= self._max_length:
+            self._current_max_length = int(self.current_lengths.max().item())
+            if self._current_max_length >= self._max_length:
+                self._allocate_more()
 
     def add_results_(
         self,
@@ -494,21 +693,26 @@ class BatchedAlignments:
             return  # nothing to add
 
         # if needed - increase storage
-        if self.current_lengths.max().item() >= self._max_length:
-            self._allocate_more()
+        self._allocate_more_if_needed()
 
-        active_lengths = self.current_lengths[active_indices]
+        # index_add_ requires the same dtype for lengths and increments
+        active_indices = active_indices.long()
+        current_lengths = self.current_lengths
+        active_lengths = current_lengths[active_indices]
         # store timesteps - same for alignments / confidence
-        self.timesteps[active_indices, active_lengths] = time_indices
+        timesteps = self.timesteps
+        timesteps.index_put_((active_indices, active_lengths), time_indices.to(timesteps.dtype))
 
         if self.with_alignments and logits is not None and labels is not None:
+            alignment_labels = self.labels
             self.logits[active_indices, active_lengths] = logits
-            self.labels[active_indices, active_lengths] = labels
+            alignment_labels.index_put_((active_indices, active_lengths), labels.to(alignment_labels.dtype))
 
         if self.with_frame_confidence and confidence is not None:
             self.frame_confidence[active_indices, active_lengths] = confidence
         # increase lengths
-        self.current_lengths[active_indices] += 1
+        current_lengths.index_add_(0, active_indices, torch.ones_like(active_indices))
+        self._current_max_length += 1
 
     def add_results_masked_(
         self,
@@ -528,8 +732,7 @@ class BatchedAlignments:
             labels: tensor with decoded labels (can contain blank)
             confidence: optional tensor with confidence for each item in batch
         """
-        if (self.current_lengths + active_mask).max() >= self._max_length:
-            self._allocate_more()
+        self._allocate_more_if_needed()
         self.add_results_masked_no_checks_(
             active_mask=active_mask, time_indices=time_indices, logits=logits, labels=labels, confidence=confidence
         )
@@ -554,18 +757,59 @@ class BatchedAlignments:
             labels: tensor with decoded labels (can contain blank)
             confidence: optional tensor with confidence for each item in batch
         """
+        batch_indices = self._batch_indices
+        current_lengths = self.current_lengths
         # store timesteps - same for alignments / confidence
-        self.timesteps[self._batch_indices, self.current_lengths] = time_indices
+        self.timesteps[batch_indices, current_lengths] = time_indices.to(self.timesteps.dtype)
 
         if self.with_alignments and logits is not None and labels is not None:
-            self.timesteps[self._batch_indices, self.current_lengths] = time_indices
-            self.logits[self._batch_indices, self.current_lengths] = logits
-            self.labels[self._batch_indices, self.current_lengths] = labels
+            self.logits[batch_indices, current_lengths] = logits
+            self.labels[batch_indices, current_lengths] = labels.to(self.labels.dtype)
 
         if self.with_frame_confidence and confidence is not None:
-            self.frame_confidence[self._batch_indices, self.current_lengths] = confidence
+            self.frame_confidence[batch_indices, current_lengths] = confidence
         # increase lengths
-        self.current_lengths += active_mask
+        current_lengths.add_(active_mask)
+        self._current_max_length += 1
+
+
+def _copy_to_cpu_non_blocking(tensor: torch.Tensor) -> torch.Tensor:
+    """
+    Start copying tensor to cpu. For CUDA tensors the copy is non-blocking (to pinned memory),
+    the caller should synchronize the current stream before using the result.
+
+    Args:
+        tensor: tensor to copy
+
+    Returns:
+        tensor on cpu
+    """
+    if not tensor.is_cuda:
+        return tensor.cpu()
+    cpu_tensor = torch.empty(tensor.shape, dtype=tensor.dtype, device="cpu", pin_memory=True)
+    cpu_tensor.copy_(tensor, non_blocking=True)
+    return cpu_tensor
+
+
+def _unpad_batch(
+    tensor: torch.Tensor, lengths: torch.Tensor, dtype: Optional[torch.dtype] = None
+) -> Tuple[torch.Tensor, ...]:
+    """
+    Convert padded batch to per-item tensors using a single masked gather (instead of slicing each item).
+
+    Args:
+        tensor: padded tensor of shape [B, T, ...]
+        lengths: lengths of items, tensor of shape [B]
+        dtype: optional dtype to convert the gathered data to
+
+    Returns:
+        tuple of B tensors, i-th tensor has shape [lengths[i], ...]
+    """
+    mask = torch.arange(tensor.shape[1], device=tensor.device)[None, :] < lengths[:, None]
+    gathered = tensor[mask]
+    if dtype is not None:
+        gathered = gathered.to(dtype)
+    return torch.split(gathered, lengths.tolist())
 
 
 def batched_hyps_to_hypotheses(
@@ -586,42 +830,59 @@ def batched_hyps_to_hypotheses(
     """
     assert batch_size is None or batch_size <= batched_hyps.scores.shape[0]
     num_hyps = batched_hyps.scores.shape[0] if batch_size is None else batch_size
+    # move all data to cpu at once: issue all the copies without blocking, then synchronize only once
+    scores = _copy_to_cpu_non_blocking(batched_hyps.scores[:num_hyps])
+    lengths = _copy_to_cpu_non_blocking(batched_hyps.current_lengths[:num_hyps])
+    transcript = _copy_to_cpu_non_blocking(batched_hyps.transcript[:num_hyps])
+    timesteps = _copy_to_cpu_non_blocking(batched_hyps.timesteps[:num_hyps])
+    if alignments is not None:
+        alignment_lengths = _copy_to_cpu_non_blocking(alignments.current_lengths[:num_hyps])
+        alignment_timesteps = _copy_to_cpu_non_blocking(alignments.timesteps[:num_hyps])
+        if alignments.with_alignments:
+            alignment_logits = _copy_to_cpu_non_blocking(alignments.logits[:num_hyps])
+            alignment_labels = _copy_to_cpu_non_blocking(alignments.labels[:num_hyps])
+        if alignments.with_frame_confidence:
+            frame_confidence = _copy_to_cpu_non_blocking(alignments.frame_confidence[:num_hyps])
+    if batched_hyps.scores.is_cuda:
+        torch.cuda.current_stream(batched_hyps.scores.device).synchronize()
+
+    scores = scores.tolist()
+    # labels and timesteps are stored as int32, Hypothesis expects torch.long
+    transcript = _unpad_batch(transcript, lengths, dtype=torch.long)
+    timesteps = _unpad_batch(timesteps, lengths, dtype=torch.long)
     hypotheses = [
         Hypothesis(
-            score=batched_hyps.scores[i].item(),
-            y_sequence=batched_hyps.transcript[i, : batched_hyps.current_lengths[i]],
-            timestep=batched_hyps.timesteps[i, : batched_hyps.current_lengths[i]],
+            score=scores[i],
+            y_sequence=transcript[i],
+            timestep=timesteps[i],
             alignments=None,
             dec_state=None,
         )
         for i in range(num_hyps)
     ]
     if alignments is not None:
-        # move all data to cpu to avoid overhead with moving data by chunks
-        alignment_lengths = alignments.current_lengths.cpu().tolist()
+        alignment_timesteps = _unpad_batch(alignment_timesteps, alignment_lengths)
         if alignments.with_alignments:
-            alignment_logits = alignments.logits.cpu()
-            alignment_labels = alignments.labels.cpu()
+            alignment_logits = _unpad_batch(alignment_logits, alignment_lengths)
+            alignment_labels = _unpad_batch(alignment_labels, alignment_lengths, dtype=torch.long)
         if alignments.with_frame_confidence:
-            frame_confidence = alignments.frame_confidence.cpu()
+            frame_confidence = _unpad_batch(frame_confidence, alignment_lengths)
 
         # for each hypothesis - aggregate alignment using unique_consecutive for time indices (~itertools.groupby)
         for i in range(len(hypotheses)):
+            _, grouped_counts = torch.unique_consecutive(alignment_timesteps[i], return_counts=True)
+            # boundaries of the groups: [0, cnt_0, cnt_0 + cnt_1, ...]
+            group_bounds = [0] + list(itertools.accumulate(grouped_counts.tolist()))
+            # unbind each hypothesis only once, then split the frames into groups (views, no copies)
             hypotheses[i].alignments = []
+            if alignments.with_alignments:
+                frames = list(zip(alignment_logits[i].unbind(0), alignment_labels[i].unbind(0)))
+                hypotheses[i].alignments = [
+                    frames[start:end] for start, end in zip(group_bounds[:-1], group_bounds[1:])
+                ]
             if alignments.with_frame_confidence:
-                hypotheses[i].frame_confidence = []
-            _, grouped_counts = torch.unique_consecutive(
-                alignments.timesteps[i, : alignment_lengths[i]], return_counts=True
-            )
-            start = 0
-            for timestep_cnt in grouped_counts.tolist():
-                if alignments.with_alignments:
-                    hypotheses[i].alignments.append(
-                        [(alignment_logits[i, start + j], alignment_labels[i, start + j]) for j in range(timestep_cnt)]
-                    )
-                if alignments.with_frame_confidence:
-                    hypotheses[i].frame_confidence.append(
-                        [frame_confidence[i, start + j] for j in range(timestep_cnt)]
-                    )
-                start += timestep_cnt
+                frame_confidence_i = frame_confidence[i].unbind(0)
+                hypotheses[i].frame_confidence = [
+                    list(frame_confidence_i[start:end]) for start, end in zip(group_bounds[:-1], group_bounds[1:])
+                ]
     return hypotheses
@@ -18,7 +18,12 @@ from typing import List
 import pytest
 import torch
 
-from nemo.collections.asr.parts.utils.rnnt_utils import BatchedAlignments, BatchedHyps, batched_hyps_to_hypotheses
+from nemo.collections.asr.parts.utils.rnnt_utils import (
+    BatchedAlignments,
+    BatchedHyps,
+    Hypothesis,
+    batched_hyps_to_hypotheses,
+)
 
 
 @contextmanager
@@ -41,6 +46,45 @@ if hasattr(torch.backends, "mps") and torch.backends.mps.is_available():
     DEVICES.append(torch.device("mps"))
 
 
+class TestHypothesis:
+    @pytest.mark.unit
+    @pytest.mark.parametrize("timestep_as_tensor", [False, True])
+    def test_non_blank_frame_confidence_rnnt(self, timestep_as_tensor: bool):
+        # frame confidence: list of confidence values for each frame (for all emitted tokens including blank)
+        frame_confidence = [[0.1], [0.2, 0.3, 0.4], [0.5], [0.6, 0.7]]
+        timestep = [1, 1, 3]
+        hyp = Hypothesis(
+            score=0.0,
+            y_sequence=[1, 2, 3],
+            timestep=torch.tensor(timestep) if timestep_as_tensor else timestep,
+            frame_confidence=frame_confidence,
+        )
+        assert hyp.non_blank_frame_confidence == [0.2, 0.3, 0.6]
+        # timestep can be a dict for RNNT
+        hyp.timestep = {"timestep": timestep}
+        assert hyp.non_blank_frame_confidence == [0.2, 0.3, 0.6]
+
+    @pytest.mark.unit
+    @pytest.mark.parametrize("timestep_as_tensor", [False, True])
+    def test_non_blank_frame_confidence_ctc(self, timestep_as_tensor: bool):
+        frame_confidence = [0.1, 0.2, 0.3, 0.4, 0.5]
+        timestep = [0, 2, 3]
+        hyp = Hypothesis(
+            score=0.0,
+            y_sequence=[1, 2, 3],
+            timestep=torch.tensor(timestep) if timestep_as_tensor else timestep,
+            frame_confidence=frame_confidence,
+        )
+        assert hyp.non_blank_frame_confidence == [0.1, 0.3, 0.4]
+
+    @pytest.mark.unit
+    def test_non_blank_frame_confidence_empty(self):
+        hyp = Hypothesis(score=0.0, y_sequence=[], timestep=[], frame_confidence=[0.1, 0.2])
+        assert hyp.non_blank_frame_confidence == []
+        hyp = Hypothesis(score=0.0, y_sequence=[1], timestep=[0], frame_confidence=None)
+        assert hyp.non_blank_frame_confidence == []
+
+
 class TestBatchedHyps:
     @pytest.mark.unit
     @pytest.mark.parametrize("device", DEVICES)
@@ -107,6 +151,48 @@ class TestBatchedHyps:
         assert hyps.last_timestep.tolist() == [1, 2]
         assert hyps.last_timestep_lasts.tolist() == [2, 1]
 
+    @pytest.mark.unit
+    @pytest.mark.parametrize("device", DEVICES)
+    def test_add_results_int32_indices(self, device: torch.device):
+        # result should be the same as with long indices
+        hyps = BatchedHyps(batch_size=2, init_length=1, device=device)
+        etalon_hyps = BatchedHyps(batch_size=2, init_length=1, device=device)
+        for active_indices in [[1], [0, 1]]:
+            for current_hyps, dtype in [(hyps, torch.int32), (etalon_hyps, torch.long)]:
+                current_hyps.add_results_(
+                    active_indices=torch.tensor(active_indices, device=device, dtype=dtype),
+                    labels=torch.tensor([5, 4][: len(active_indices)], device=device),
+                    time_indices=torch.tensor([1, 1][: len(active_indices)], device=device),
+                    scores=torch.tensor([0.5, 1.0][: len(active_indices)], device=device),
+                )
+        assert hyps.current_lengths.tolist() == etalon_hyps.current_lengths.tolist() == [1, 2]
+        assert hyps.transcript[:, :2].tolist()[1] == etalon_hyps.transcript[:, :2].tolist()[1] == [5, 4]
+        assert hyps.scores.tolist() == pytest.approx(etalon_hyps.scores.tolist())
+        assert hyps.last_timestep.tolist() == etalon_hyps.last_timestep.tolist()
+        assert hyps.last_timestep_lasts.tolist() == etalon_hyps.last_timestep_lasts.tolist() == [1, 2]
+
+    @pytest.mark.unit
+    @pytest.mark.parametrize("device", DEVICES)
+    def test_add_results_no_sync(self, device: torch.device):
+        # batch of size 2, add labels for both utterances (storage is sufficient)
+        hyps = BatchedHyps(batch_size=2, init_length=2, device=device)
+        active_indices = torch.tensor([0, 1], device=device)
+        time_indices = torch.tensor([1, 2], device=device)
+        scores = torch.tensor([0.5, 1.0], device=device)
+        labels = torch.tensor([5, 4], device=device)
+        # check there are no blocking operations: storage is checked using host-side upper bound for max length
+        with avoid_sync_operations(device=device):
+            hyps.add_results_no_checks_(
+                active_indices=active_indices, labels=labels, time_indices=time_indices, scores=scores
+            )
+            hyps.add_results_(active_indices=active_indices, labels=labels, time_indices=time_indices, scores=scores)
+        assert hyps.current_lengths.tolist() == [2, 2]
+        assert hyps.transcript.tolist()[0][:2] == [5, 5]
+        assert hyps.timesteps.tolist()[1][:2] == [2, 2]
+        assert hyps.scores.tolist() == pytest.approx([1.0, 2.0])
+        assert hyps.last_timestep.tolist() == [1, 2]
+        assert hyps.last_timestep_lasts.tolist() == [2, 2]
+
     @pytest.mark.unit
     @pytest.mark.parametrize("device", DEVICES)
     def test_add_results_masked(self, device: torch.device):
@@ -147,6 +233,43 @@ class TestBatchedHyps:
         assert hyps.last_timestep.tolist() == [1, -1]
         assert hyps.last_timestep_lasts.tolist() == [1, 0]
 
+    @pytest.mark.unit
+    @pytest.mark.parametrize("device", DEVICES)
+    def test_add_results_masked_with_reallocation(self, device: torch.device):
+        # batch of size 2, add labels to trigger storage reallocation
+        hyps = BatchedHyps(batch_size=2, init_length=1, device=device)
+        for step in range(3):
+            hyps.add_results_masked_(
+                active_mask=torch.tensor([True, step % 2 == 0], device=device),
+                labels=torch.tensor([step + 1, step + 4], device=device),
+                time_indices=torch.tensor([step, step], device=device),
+                scores=torch.tensor([1.0, 1.0], device=device),
+            )
+        assert hyps.transcript.shape == (2, 4)
+        assert hyps.current_lengths.tolist() == [3, 2]
+        assert hyps.transcript.tolist()[0][:3] == [1, 2, 3]
+        assert hyps.transcript.tolist()[1][:2] == [4, 6]
+        assert hyps.timesteps.tolist()[1][:2] == [0, 2]
+        assert hyps.scores.tolist() == pytest.approx([3.0, 2.0])
+
+    @pytest.mark.unit
+    @pytest.mark.parametrize("device", DEVICES)
+    def test_add_results_masked_sparse_no_reallocation(self, device: torch.device):
+        # number of calls exceeds the storage length, but actual lengths do not: storage should not be increased
+        hyps = BatchedHyps(batch_size=2, init_length=2, device=device)
+        for step in range(6):
+            hyps.add_results_masked_(
+                active_mask=torch.tensor([step == 0, step == 5], device=device),
+                labels=torch.tensor([step + 1, step + 4], device=device),
+                time_indices=torch.tensor([step, step], device=device),
+                scores=torch.tensor([1.0, 1.0], device=device),
+            )
+        assert hyps.transcript.shape == (2, 2)
+        assert hyps.current_lengths.tolist() == [1, 1]
+        assert hyps.transcript[0, :1].tolist() == [1]
+        assert hyps.transcript[1, :1].tolist() == [9]
+        assert hyps.scores.tolist() == pytest.approx([1.0, 1.0])
+
     @pytest.mark.unit
     @pytest.mark.parametrize("device", DEVICES)
     def test_add_multiple_results_masked(self, device: torch.device):
@@ -173,6 +296,120 @@ class TestBatchedHyps:
         assert hyps.last_timestep.tolist() == [1, 2]
         assert hyps.last_timestep_lasts.tolist() == [2, 1]
 
+    @pytest.mark.unit
+    @pytest.mark.parametrize("device", DEVICES)
+    def test_add_results_all_active(self, device: torch.device):
+        # result should be the same as for `add_results_` with all indices
+        hyps = BatchedHyps(batch_size=2, init_length=1, device=device)
+        etalon_hyps = BatchedHyps(batch_size=2, init_length=1, device=device)
+        for labels, time_indices in [([5, 1], [0, 0]), ([2, 4], [0, 1]), ([3, 3], [0, 2])]:
+            labels = torch.tensor(labels, device=device)
+            time_indices = torch.tensor(time_indices, device=device)
+            scores = torch.tensor([0.5, 1.0], device=device)
+            hyps.add_results_all_active_(labels=labels, time_indices=time_indices, scores=scores)
+            etalon_hyps.add_results_(
+                active_indices=torch.arange(2, device=device),
+                labels=labels,
+                time_indices=time_indices,
+                scores=scores,
+            )
+        assert hyps.current_lengths.tolist() == [3, 3]
+        assert hyps.transcript[:, :3].tolist() == etalon_hyps.transcript[:, :3].tolist()
+        assert hyps.timesteps[:, :3].tolist() == etalon_hyps.timesteps[:, :3].tolist()
+        assert hyps.scores.tolist() == pytest.approx(etalon_hyps.scores.tolist())
+        assert hyps.last_timestep.tolist() == [0, 2]
+        assert hyps.last_timestep_lasts.tolist() == etalon_hyps.last_timestep_lasts.tolist() == [3, 1]
+
+    @pytest.mark.unit
+    @pytest.mark.parametrize("device", DEVICES)
+    @pytest.mark.parametrize("init_length,max_length_hint,expected_storage_length", [(3, 3, 3), (1, 3, 3), (1, 2, 4)])
+    def test_add_results_with_max_length_hint(
+        self, device: torch.device, init_length: int, max_length_hint: int, expected_storage_length: int
+    ):
+        # storage is increased up to max_length_hint (no extra growth if the hint is sufficient)
+        hyps = BatchedHyps(batch_size=2, init_length=init_length, max_length_hint=max_length_hint, device=device)
+        for step in range(3):
+            hyps.add_results_(
+                active_indices=torch.tensor([0, 1], device=device),
+                labels=torch.tensor([step + 1, step + 4], device=device),
+                time_indices=torch.tensor([step, step], device=device),
+                scores=torch.tensor([1.0, 1.0], device=device),
+            )
+        assert hyps.transcript.shape == (2, expected_storage_length)
+        assert hyps.current_lengths.tolist() == [3, 3]
+        assert hyps.transcript[:, :3].tolist() == [[1, 2, 3], [4, 5, 6]]
+
+    @pytest.mark.unit
+    @pytest.mark.parametrize("device", DEVICES)
+    def test_bfloat16_scores(self, device: torch.device):
+        # accumulated bfloat16 scores should be close to float32 scores
+        num_steps = 5
+        generator = torch.Generator().manual_seed(777)
+        # negative scores (log-probs): partial sums are bounded by the final score
+        all_scores = -torch.rand((num_steps, 2), generator=generator).to(device)
+        hyps_fp32 = BatchedHyps(batch_size=2, init_length=1, device=device, float_dtype=torch.float32)
+        hyps_bf16 = BatchedHyps(batch_size=2, init_length=1, device=device, float_dtype=torch.bfloat16)
+        for step in range(num_steps):
+            labels = torch.tensor([step, step + 1], device=device)
+            time_indices = torch.tensor([step, step // 2], device=device)
+            scores = all_scores[step]
+            for hyps in [hyps_fp32, hyps_bf16]:
+                hyps.add_results_(
+                    active_indices=torch.tensor([0], device=device),
+                    labels=labels[:1],
+                    time_indices=time_indices[:1],
+                    scores=scores[:1],
+                )
+                hyps.add_results_masked_(
+                    active_mask=torch.tensor([True, step % 2 == 0], device=device),
+                    labels=labels,
+                    time_indices=time_indices,
+                    scores=scores,
+                )
+        assert hyps_bf16.scores.dtype == torch.bfloat16
+        # rounding error for each addition (including conversion of the added score) is bounded
+        # by eps/2 * |partial sum| <= eps/2 * |final score|
+        num_additions = [2 * num_steps, (num_steps + 1) // 2]
+        eps = torch.finfo(torch.bfloat16).eps
+        for scores_fp32, scores_bf16, num_added in zip(
+            hyps_fp32.scores.tolist(), hyps_bf16.scores.tolist(), num_additions
+        ):
+            assert scores_bf16 == pytest.approx(scores_fp32, rel=num_added * eps)
+
+    @pytest.mark.unit
+    @pytest.mark.parametrize("device", DEVICES)
+    def test_clear_and_reuse(self, device: torch.device):
+        # results after clearing the storage should be the same as for the fresh instance
+        def add_results(hyps: BatchedHyps):
+            hyps.add_results_(
+                active_indices=torch.tensor([0], device=device),
+                labels=torch.tensor([5], device=device),
+                time_indices=torch.tensor([1], device=device),
+                scores=torch.tensor([0.5], device=device),
+            )
+            hyps.add_results_masked_(
+                active_mask=torch.tensor([True, True], device=device),
+                labels=torch.tensor([2, 4], device=device),
+                time_indices=torch.tensor([1, 2], device=device),
+                scores=torch.tensor([1.0, 1.0], device=device),
+            )
+
+        etalon_hyps = BatchedHyps(batch_size=2, init_length=1, device=device)
+        add_results(etalon_hyps)
+        hyps = BatchedHyps(batch_size=2, init_length=1, device=device)
+        for _ in range(2):
+            add_results(hyps)
+            hyps.clear_()
+            assert hyps.current_lengths.tolist() == [0, 0]
+        add_results(hyps)
+        assert hyps.current_lengths.tolist() == etalon_hyps.current_lengths.tolist()
+        for i, length in enumerate(etalon_hyps.current_lengths.tolist()):
+            assert hyps.transcript[i, :length].tolist() == etalon_hyps.transcript[i, :length].tolist()
+            assert hyps.timesteps[i, :length].tolist() == etalon_hyps.timesteps[i, :length].tolist()
+        assert hyps.scores.tolist() == pytest.approx(etalon_hyps.scores.tolist())
+        assert hyps.last_timestep.tolist() == etalon_hyps.last_timestep.tolist()
+        assert hyps.last_timestep_lasts.tolist() == etalon_hyps.last_timestep_lasts.tolist()
+
     @pytest.mark.unit
     @pytest.mark.parametrize("device", DEVICES)
     def test_torch_jit_compatibility_add_results(self, device: torch.device):
@@ -278,6 +515,78 @@ class TestBatchedAlignments:
                 alignments.logits[i, : alignments.current_lengths[i]] == sample_logits[i, add_logits_mask[i]]
             ).all()
 
+    @pytest.mark.unit
+    @pytest.mark.parametrize("device", DEVICES)
+    def test_add_results_int32_indices(self, device: torch.device):
+        # result should be the same as with long indices
+        alignments = BatchedAlignments(batch_size=2, logits_dim=7, init_length=1, device=device)
+        etalon_alignments = BatchedAlignments(batch_size=2, logits_dim=7, init_length=1, device=device)
+        sample_logits = torch.rand((2, 7), device=device)
+        for active_indices in [[1], [0, 1]]:
+            for current_alignments, dtype in [(alignments, torch.int32), (etalon_alignments, torch.long)]:
+                current_alignments.add_results_(
+                    active_indices=torch.tensor(active_indices, device=device, dtype=dtype),
+                    logits=sample_logits[: len(active_indices)],
+                    labels=torch.tensor([5, 4][: len(active_indices)], device=device),
+                    time_indices=torch.tensor([1, 1][: len(active_indices)], device=device),
+                )
+        assert alignments.current_lengths.tolist() == etalon_alignments.current_lengths.tolist() == [1, 2]
+        assert alignments.labels[1, :2].tolist() == etalon_alignments.labels[1, :2].tolist() == [5, 4]
+        assert alignments.timesteps[1, :2].tolist() == etalon_alignments.timesteps[1, :2].tolist() == [1, 1]
+        assert (alignments.logits[1, :2] == etalon_alignments.logits[1, :2]).all()
+
+    @pytest.mark.unit
+    @pytest.mark.parametrize("device", DEVICES)
+    def test_add_results_with_reallocation(self, device: torch.device):
+        # batch of size 2, add results for both utterances to trigger storage reallocation
+        batch_size = 2
+        logits_dim = 7
+        alignments = BatchedAlignments(
+            batch_size=batch_size,
+            logits_dim=logits_dim,
+            init_length=1,
+            device=device,
+            store_frame_confidence=True,
+        )
+        sample_logits = torch.rand((batch_size, 2, logits_dim), device=device)
+        sample_confidence = torch.rand((batch_size, 2), device=device)
+        for t in range(2):
+            alignments.add_results_(
+                active_indices=torch.arange(batch_size, device=device),
+                logits=sample_logits[:, t],
+                labels=torch.argmax(sample_logits[:, t], dim=-1),
+                time_indices=torch.tensor([t, t], device=device),
+                confidence=sample_confidence[:, t],
+            )
+        assert alignments.logits.shape == (batch_size, 2, logits_dim)
+        assert alignments.labels.shape == (batch_size, 2)
+        assert alignments.frame_confidence.shape == (batch_size, 2)
+        assert alignments.current_lengths.tolist() == [2, 2]
+        # data before reallocation is preserved
+        assert torch.allclose(alignments.logits, sample_logits)
+        assert torch.allclose(alignments.frame_confidence, sample_confidence)
+        assert alignments.timesteps.tolist() == [[0, 1], [0, 1]]
+
+    @pytest.mark.unit
+    @pytest.mark.parametrize("device", DEVICES)
+    def test_add_results_masked_sparse_with_max_length_hint(self, device: torch.device):
+        # number of calls exceeds the actual length (as in the inner loop of the loop-labels decoding):
+        # storage should be increased only up to max_length_hint, which is an upper bound for the length
+        alignments = BatchedAlignments(batch_size=2, logits_dim=7, init_length=2, max_length_hint=5, device=device)
+        sample_logits = torch.rand((2, 7), device=device)
+        active_steps = [0, 2, 5, 8, 11]
+        for step in range(12):
+            alignments.add_results_masked_(
+                active_mask=torch.tensor([step in active_steps, step == 0], device=device),
+                logits=sample_logits,
+                labels=torch.tensor([step, step], device=device),
+                time_indices=torch.tensor([step, step], device=device),
+            )
+        assert alignments.logits.shape == (2, 5, 7)
+        assert alignments.current_lengths.tolist() == [5, 1]
+        assert alignments.labels[0].tolist() == active_steps
+        assert alignments.timesteps[0].tolist() == active_steps
+
     @pytest.mark.unit
     @pytest.mark.parametrize("device", DEVICES)
     def test_add_results_masked(self, device: torch.device):
@@ -378,12 +687,15 @@ class TestConvertToHypotheses:
             scores=torch.tensor([1.0, 1.0], device=device),
         )
         hypotheses = batched_hyps_to_hypotheses(hyps)
-        assert (hypotheses[0].y_sequence == torch.tensor([5, 2], device=device)).all()
-        assert (hypotheses[1].y_sequence == torch.tensor([4], device=device)).all()
+        # labels and timesteps are stored as int32, but returned as long
+        assert hypotheses[0].y_sequence.dtype == torch.long
+        assert hypotheses[0].timestep.dtype == torch.long
+        assert (hypotheses[0].y_sequence == torch.tensor([5, 2])).all()
+        assert (hypotheses[1].y_sequence == torch.tensor([4])).all()
         assert hypotheses[0].score == pytest.approx(1.5)
         assert hypotheses[1].score == pytest.approx(1.0)
-        assert (hypotheses[0].timestep == torch.tensor([1, 1], device=device)).all()
-        assert (hypotheses[1].timestep == torch.tensor([2], device=device)).all()
+        assert (hypotheses[0].timestep == torch.tensor([1, 1])).all()
+        assert (hypotheses[1].timestep == torch.tensor([2])).all()
 
     @pytest.mark.unit
     @pytest.mark.parametrize("device", DEVICES)
@@ -438,12 +750,12 @@ class TestConvertToHypotheses:
         )
 
         hypotheses = batched_hyps_to_hypotheses(hyps, alignments)
-        assert (hypotheses[0].y_sequence == torch.tensor([5, 2], device=device)).all()
-        assert (hypotheses[1].y_sequence == torch.tensor([4], device=device)).all()
+        assert (hypotheses[0].y_sequence == torch.tensor([5, 2])).all()
+        assert (hypotheses[1].y_sequence == torch.tensor([4])).all()
         assert hypotheses[0].score == pytest.approx(1.5)
         assert hypotheses[1].score == pytest.approx(1.0)
-        assert (hypotheses[0].timestep == torch.tensor([0, 1], device=device)).all()
-        assert (hypotheses[1].timestep == torch.tensor([1], device=device)).all()
+        assert (hypotheses[0].timestep == torch.tensor([0, 1])).all()
+        assert (hypotheses[1].timestep == torch.tensor([1])).all()
 
         etalon = [
             [
@@ -466,3 +778,41 @@ class TestConvertToHypotheses:
                 for step, (label, current_logits) in enumerate(group_for_timestep):
                     assert torch.allclose(hypotheses[batch_i].alignments[t][step][0], current_logits)
                     assert hypotheses[batch_i].alignments[t][step][1] == label
+
+    @pytest.mark.unit
+    @pytest.mark.parametrize("device", DEVICES)
+    def test_convert_to_hypotheses_large_values(self, device: torch.device):
+        # labels and timesteps are stored as int32: results should be the same as for long values
+        batch_size = 2
+        max_label = 2**31 - 1
+        etalon_labels = [[2**16 + 1, max_label, 2**17], [max_label - 1, 2**16]]
+        etalon_timesteps = [[0, 2**20, 2**20], [2**16, 2**30]]
+        etalon_frame_lengths = [[1, 2], [1, 1]]
+        hyps = BatchedHyps(batch_size=batch_size, init_length=1, device=device)
+        alignments = BatchedAlignments(batch_size=batch_size, init_length=1, logits_dim=3, device=device)
+        for step in range(3):
+            active_indices = [i for i in range(batch_size) if step < len(etalon_labels[i])]
+            labels = torch.tensor([etalon_labels[i][step] for i in active_indices], device=device)
+            time_indices = torch.tensor([etalon_timesteps[i][step] for i in active_indices], device=device)
+            hyps.add_results_(
+                active_indices=torch.tensor(active_indices, device=device),
+                labels=labels,
+                time_indices=time_indices,
+                scores=torch.zeros(len(active_indices), device=device),
+            )
+            alignments.add_results_(
+                active_indices=torch.tensor(active_indices, device=device),
+                logits=torch.zeros((len(active_indices), 3), device=device),
+                labels=labels,
+                time_indices=time_indices,
+            )
+
+        hypotheses = batched_hyps_to_hypotheses(hyps, alignments)
+        for i, hyp in enumerate(hypotheses):
+            assert torch.equal(hyp.y_sequence, torch.tensor(etalon_labels[i], dtype=torch.long))
+            assert torch.equal(hyp.timestep, torch.tensor(etalon_timesteps[i], dtype=torch.long))
+            alignment_labels = [label for frame in hyp.alignments for _, label in frame]
+            assert all(label.dtype == torch.long for label in alignment_labels)
+            assert torch.equal(torch.stack(alignment_labels), torch.tensor(etalon_labels[i], dtype=torch.long))
+            # alignments are grouped by timesteps
+            assert [len(frame) for frame in hyp.alignments] == etalon_frame_lengths[i]
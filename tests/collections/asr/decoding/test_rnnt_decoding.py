@@ -233,6 +233,41 @@ class TestRNNTDecoding:
 
                     t_u.append(int(label))
 
+    @pytest.mark.unit
+    @pytest.mark.parametrize("max_symbols", [1, 3])
+    def test_loop_labels_greedy_decoding_bfloat16_scores(self, monkeypatch, max_symbols: int):
+        """Test that storing hypotheses scores in bfloat16 does not change decoded labels"""
+        vocab_size = 8
+        decoder = get_rnnt_decoder(vocab_size=vocab_size)
+        joint = get_rnnt_joint(vocab_size=vocab_size)
+        search_algo = greedy_decode.GreedyBatchedRNNTInfer(
+            decoder,
+            joint,
+            blank_index=vocab_size,
+            max_symbols_per_step=max_symbols,
+            loop_labels=True,
+            use_cuda_graph_decoder=False,
+        )
+        generator = torch.Generator().manual_seed(777)
+        enc_out = torch.randn((3, 4, 20), generator=generator)  # [B, D, T]
+        enc_len = torch.tensor([20, 13, 5])
+
+        with torch.no_grad():
+            etalon_hyps = search_algo(encoder_output=enc_out, encoded_lengths=enc_len)[0]
+            # force bfloat16 scores in BatchedHyps, other computations are not changed
+            batched_hyps_class = rnnt_utils.BatchedHyps
+            monkeypatch.setattr(
+                rnnt_utils,
+                "BatchedHyps",
+                lambda *args, **kwargs: batched_hyps_class(*args, **{**kwargs, "float_dtype": torch.bfloat16}),
+            )
+            hyps = search_algo(encoder_output=enc_out, encoded_lengths=enc_len)[0]
+
+        assert sum(len(hyp.y_sequence) for hyp in etalon_hyps) > 0
+        for hyp, etalon_hyp in zip(hyps, etalon_hyps):
+            assert hyp.y_sequence.tolist() == etalon_hyp.y_sequence.tolist()
+            assert hyp.timestep.tolist() == etalon_hyp.timestep.tolist()
+
     @pytest.mark.skipif(
         not NUMBA_RNNT_LOSS_AVAILABLE, reason='RNNTLoss has not been compiled with appropriate numba version.',
     )